@@ -4,19 +4,24 @@ civitai_bulk_uploader.py — debug-focused build
 Changes for this build:
 - ONLY uses https://civitai.com/posts/create (no /create, no homepage).
 - --minimized to start Chromium minimized/off-screen (ignored during --login).
-- --thumb-timeout to control how long we wait for thumbnails.
+- --thumb-timeout to control how long we wait for uploads/thumbnails.
 - Timestamped, ultra-detailed --debug logs (clicks, waits, durations).
 - Retry filling Title after upload if the field wasn't ready at first.
 """
 
 import asyncio
 import argparse
+import atexit
 import os
 import sys
 import time
 import random
+import re
 import hashlib
+import json
+import mmap
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Tuple, Dict, Optional
 
@@ -25,6 +30,11 @@ from tenacity import retry, stop_after_attempt, wait_exponential_jitter
 
 from playwright.async_api import async_playwright, Page, BrowserContext, Locator
 
+try:  # optional: faster (de)serialization of large storage_state files
+    import orjson
+except ImportError:
+    orjson = None
+
 # ---------------------- CONFIG ----------------------
 
 SELECTORS = {
@@ -43,11 +53,22 @@ SELECTORS = {
 
 ALLOWED_EXT = {".png", ".jpg", ".jpeg", ".webp"}
 
+# A response whose URL contains all of these marks one finished image upload
+UPLOAD_RESPONSE_HINTS = ("/api/", "image")
+THUMB_FALLBACK_MS = 10_000
+
+# Published post URL; Playwright applies it with re.search, so no leading ".*"
+POST_URL_RE = re.compile(r"/posts/\d+(/edit)?(?:$|[?#])")
+
 DEFAULT_POST_SIZE = 20
 DEFAULT_CONCURRENCY = 1
 DEFAULT_PAUSE_RANGE = (4, 8)
+DEFAULT_CONTEXT_RECYCLE = 25
+STATE_SAVE_EVERY = 50
 STORAGE_STATE = "storage_state.json"
 SQLITE_DB = "uploaded.db"
+HASH_WORKERS = min(16, (os.cpu_count() or 1) * 2)
+MMAP_MIN_SIZE = 4 * 1024 * 1024  # smaller files keep the buffered read path
 
 # ---------------------- DEBUG LOGGER ----------------------
 
@@ -55,20 +76,34 @@ class DebugLogger:
     def __init__(self, enabled: bool, log_file: Optional[Path] = None):
         self.enabled = enabled
         self.log_file = log_file
+        self._fh = None
+        self._ts_sec = -1
+        self._ts_str = ""
         if self.enabled and self.log_file:
             self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            # opened once and buffered; flushed after each post (flush()) and on exit
+            self._fh = self.log_file.open("a", encoding="utf-8", buffering=1 << 16)
+            atexit.register(self._fh.close)
 
     def ts(self) -> str:
-        return time.strftime("%Y-%m-%d %H:%M:%S")
+        now = int(time.time())
+        if now != self._ts_sec:
+            self._ts_sec = now
+            self._ts_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        return self._ts_str
 
     def _write(self, line: str):
         if not self.enabled:
             return
         msg = f"[{self.ts()}] {line}"
         print(msg, flush=True)
-        if self.log_file:
-            with self.log_file.open("a", encoding="utf-8") as f:
-                f.write(msg + "\n")
+        if self._fh:
+            self._fh.write(msg)
+            self._fh.write("\n")
+
+    def flush(self):
+        if self._fh:
+            self._fh.flush()
 
     def info(self, text: str): self._write(text)
     def click_try(self, selector: str, nth: Optional[int] = None):
@@ -95,6 +130,17 @@ class DebugLogger:
 
 # ---------------------- HELPERS ----------------------
 
+def write_state(state: dict, path: str = STORAGE_STATE):
+    data = orjson.dumps(state) if orjson else json.dumps(state).encode("utf-8")
+    # write-then-rename so a kill mid-write never leaves a truncated session file
+    tmp = path + ".tmp"
+    Path(tmp).write_bytes(data)
+    os.replace(tmp, path)
+
+def read_state(path: str = STORAGE_STATE) -> dict:
+    data = Path(path).read_bytes()
+    return orjson.loads(data) if orjson else json.loads(data)
+
 async def goto(page: Page, url: str, dbg: DebugLogger, wait_until="domcontentloaded", timeout=120_000):
     dbg.nav(url, f"(wait_until={wait_until}, timeout={timeout}ms)")
     return await page.goto(url, wait_until=wait_until, timeout=timeout)
@@ -119,18 +165,61 @@ async def fill(page: Page, selector: str, value: str, dbg: DebugLogger, timeout:
         dbg.info(f"FILL err {selector} -> {repr(e)}")
         return False
 
+def watch_upload_responses(page: Page, expected: int) -> asyncio.Future:
+    # resolves once `expected` upload XHRs succeed; cancelling it detaches the listener
+    fut = asyncio.get_running_loop().create_future()
+    count = 0
+    def _on_response(resp):
+        nonlocal count
+        if resp.ok and all(h in resp.url for h in UPLOAD_RESPONSE_HINTS):
+            count += 1
+            if count >= expected and not fut.done():
+                fut.set_result(count)
+    page.on("response", _on_response)
+    fut.add_done_callback(lambda _: page.remove_listener("response", _on_response))
+    return fut
+
 # ---------------------- CORE ----------------------
 
 def sha256_file(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open('rb') as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b''):
-            h.update(chunk)
-    return h.hexdigest()
+    with path.open('rb', buffering=0) as f:
+        if os.fstat(f.fileno()).st_size > MMAP_MIN_SIZE:
+            # large images: hash straight from the page cache, no per-chunk copies
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                return hashlib.sha256(mm).hexdigest()
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        h = hashlib.sha256()
+        buf = bytearray(1024 * 1024)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+        return h.hexdigest()
+
+async def hash_files(files: List[Path], pool: ThreadPoolExecutor) -> List[str]:
+    # hashlib releases the GIL while digesting, so threads scale across files
+    loop = asyncio.get_running_loop()
+    return list(await asyncio.gather(*(loop.run_in_executor(pool, sha256_file, f) for f in files)))
 
 def init_db(db_path: str = SQLITE_DB):
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
+    # single writer, append-only: WAL + NORMAL sync is safe and avoids double fsyncs
+    cur.executescript(
+        """
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+        PRAGMA busy_timeout=60000;
+        """
+    )
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS uploads (
@@ -141,38 +230,76 @@ def init_db(db_path: str = SQLITE_DB):
         )
         """
     )
+    # stat cache, one row per file path: lets later runs skip re-hashing unchanged files
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS file_stats (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            sha256 TEXT
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_uploads_sha ON uploads(sha256)")
+    cur.execute("ANALYZE")
     conn.commit()
     return conn
 
-def already_uploaded(conn, digest: str) -> bool:
+def known_digests(conn) -> set:
+    # one scan into memory; per-file lookups are then O(1) with no SQL round-trips
     cur = conn.cursor()
-    cur.execute("SELECT 1 FROM uploads WHERE sha256 = ?", (digest,))
-    return cur.fetchone() is not None
+    cur.execute("SELECT sha256 FROM uploads")
+    return {row[0] for row in cur.fetchall()}
 
-def mark_uploaded(conn, digest: str, path: Path):
+def known_stats(conn) -> set:
+    # (path, size, mtime) of files already hashed; a match means the file is unchanged
     cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO uploads (sha256, path) VALUES (?, ?)", (digest, str(path)))
-    conn.commit()
+    cur.execute("SELECT path, size, mtime FROM file_stats")
+    return {(row[0], row[1], row[2]) for row in cur.fetchall()}
+
+def mark_uploaded(conn, rows: List[Tuple[str, str]]):
+    # rows: (sha256, path) of posted files; caller owns the transaction (`with conn:`)
+    if not rows:
+        return
+    cur = conn.cursor()
+    cur.executemany("INSERT OR IGNORE INTO uploads (sha256, path) VALUES (?, ?)", rows)
+
+def record_stats(conn, rows: List[Tuple[str, int, float, str]]):
+    # rows: (path, size, mtime, sha256) of files whose content is recorded in uploads
+    if not rows:
+        return
+    cur = conn.cursor()
+    cur.executemany("INSERT OR REPLACE INTO file_stats (path, size, mtime, sha256) VALUES (?, ?, ?, ?)", rows)
 
 def discover_images(root: Path) -> List[Path]:
-    files: List[Path] = []
-    for p in root.rglob("*"):
-        if p.is_file() and p.suffix.lower() in ALLOWED_EXT:
-            files.append(p)
-    files.sort()
-    return files
-
-def group_batches(files: List[Path], group_by: str, post_size: int) -> List[List[Path]]:
+    # iterative scandir walk: DirEntry caches the stat, so no extra syscalls per file
+    found: List[str] = []
+    stack = [str(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.is_file():
+                        dot = e.name.rfind(".")
+                        if dot > 0 and e.name[dot:].lower() in ALLOWED_EXT:
+                            found.append(e.path)
+        except OSError:
+            continue  # unreadable dir (or --dir is a file): skip it, like rglob did
+    # compare component-wise, case-folded on Windows, like Path ordering ("set/" before "set-2/")
+    found.sort(key=lambda p: os.path.normcase(p).split(os.sep))
+    return [Path(p) for p in found]
+
+def group_units(files: List[Path], group_by: str) -> List[List[Path]]:
+    # files that may share a post: one list per folder, or everything for "flat"
     if group_by == "folder":
-        groups: List[List[Path]] = []
         by_dir: Dict[Path, List[Path]] = {}
         for f in files:
             by_dir.setdefault(f.parent, []).append(f)
-        for _, lst in by_dir.items():
-            for i in range(0, len(lst), post_size):
-                groups.append(lst[i:i + post_size])
-        return groups
-    return [files[i:i + post_size] for i in range(0, len(files), post_size)]
+        return list(by_dir.values())
+    return [files] if files else []
 
 def title_for_group(group: List[Path], title_from: str) -> str:
     if title_from == "folder":
@@ -190,9 +317,11 @@ def parse_args():
     ap.add_argument("--title-from", choices=["folder", "file", "auto"], default="folder", help="How to auto-generate the post title.")
     ap.add_argument("--tags", type=str, default="", help="Comma-separated tags to add to each post (optional).")
     ap.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="How many posts to create in parallel. Keep low.")
+    ap.add_argument("--context-recycle", type=int, default=DEFAULT_CONTEXT_RECYCLE, help="Recreate the browser context every N posts to cap memory (0 = never).")
     ap.add_argument("--publish-timeout", type=int, default=180, help="Seconds to wait for publish to complete before one retry.")
-    ap.add_argument("--thumb-timeout", type=int, default=90, help="Seconds to wait for thumbnails before falling back to networkidle.")
+    ap.add_argument("--thumb-timeout", type=int, default=90, help="Seconds to wait for image upload responses before falling back to a thumbnail check.")
     ap.add_argument("--pause", type=str, default=f"{DEFAULT_PAUSE_RANGE[0]}-{DEFAULT_PAUSE_RANGE[1]}", help="Random pause seconds between key steps, e.g. '3-7'.")
+    ap.add_argument("--seed", type=int, default=None, help="Seed for the random pause schedule (reproducible pacing).")
     ap.add_argument("--dry-run", action="store_true", help="Do everything except clicking Publish.")
     ap.add_argument("--skip-hashes", action="store_true", help="Skip local dedupe by file hash database.")
     ap.add_argument("--verbose", action="store_true", help="High-level progress logs.")
@@ -250,7 +379,7 @@ async def do_login(play, storage_state: str, dbg: DebugLogger):
             await t
 
     try:
-        await context.storage_state(path=storage_state)
+        write_state(await context.storage_state(), storage_state)
         dbg.info(f"Saved session to {storage_state}")
     finally:
         await browser.close()
@@ -268,7 +397,7 @@ async def upload_one_post(
     images: List[Path],
     title: str,
     tags: List[str],
-    pause_range: Tuple[int, int],
+    publish_pause: float,
     dry_run: bool,
     verbose: bool,
     publish_timeout: int,
@@ -276,6 +405,24 @@ async def upload_one_post(
     dbg: DebugLogger
 ) -> bool:
     page = await context.new_page()
+    try:
+        return await fill_and_publish(page, images, title, tags, publish_pause, dry_run, verbose, publish_timeout, thumb_timeout, dbg)
+    finally:
+        # always release the page, including when a wait/navigation raises
+        await page.close()
+
+async def fill_and_publish(
+    page: Page,
+    images: List[Path],
+    title: str,
+    tags: List[str],
+    publish_pause: float,
+    dry_run: bool,
+    verbose: bool,
+    publish_timeout: int,
+    thumb_timeout: int,
+    dbg: DebugLogger
+) -> bool:
     await open_post_editor(page, verbose=verbose, dbg=dbg)
 
     # Title (first attempt)
@@ -286,11 +433,11 @@ async def upload_one_post(
         try:
             dbg.info("[post] adding tags")
             tag_input = page.locator(SELECTORS["tags_input"]).first
-            for tag in tags:
-                await tag_input.fill(tag.strip())
-                dbg.keys("Enter (confirm tag)")
-                await page.keyboard.press("Enter")
-                await asyncio.sleep(0.2)
+            await tag_input.click()
+            # one keystroke stream; "\n" is typed as Enter, confirming each tag
+            stream = "".join(f"{t.strip()}\n" for t in tags)
+            dbg.keys(f"{len(tags)} tags, Enter after each")
+            await page.keyboard.type(stream)
         except Exception as e:
             dbg.info(f"[post] tags failed: {repr(e)}")
 
@@ -298,35 +445,47 @@ async def upload_one_post(
     paths = [str(p) for p in images]
     t0 = time.monotonic()
     uploaded_ok = False
+    inputs = page.locator(SELECTORS["file_input"])
+    uploads_done = watch_upload_responses(page, len(paths))
     try:
-        inputs = page.locator(SELECTORS["file_input"])
-        count = await inputs.count()
-        dbg.info(f"[upload] {count} file inputs on page")
-        if count == 0:
-            raise RuntimeError("no file inputs found")
-        for i in range(count):
-            dbg.info(f"[upload] trying input #{i}")
-            try:
-                await inputs.nth(i).set_input_files(paths, timeout=120_000)
-                dbg.files(paths)
-                dbg.info(f"[upload] set files via input #{i}")
-                uploaded_ok = True
-                break
-            except Exception as e:
-                dbg.info(f"[upload] input #{i} failed: {repr(e)}")
+        # direct path: one call, auto-waits for the dropzone input to attach (hidden inputs are fine)
+        await inputs.first.set_input_files(paths, timeout=120_000)
+        dbg.files(paths)
+        dbg.info("[upload] set files via input #0")
+        uploaded_ok = True
     except Exception as e:
-        dbg.info(f"[upload] Strategy A failed: {repr(e)}")
+        dbg.info(f"[upload] input #0 failed: {repr(e)}")
+
+    if not uploaded_ok:
+        # fallback only after a failure: walk any other file inputs
+        try:
+            count = await inputs.count()
+            dbg.info(f"[upload] {count} file inputs on page")
+            for i in range(1, count):
+                dbg.info(f"[upload] trying input #{i}")
+                try:
+                    await inputs.nth(i).set_input_files(paths, timeout=120_000)
+                    dbg.files(paths)
+                    dbg.info(f"[upload] set files via input #{i}")
+                    uploaded_ok = True
+                    break
+                except Exception as e:
+                    dbg.info(f"[upload] input #{i} failed: {repr(e)}")
+        except Exception as e:
+            dbg.info(f"[upload] Strategy A failed: {repr(e)}")
 
-    # Wait for thumbnails with configurable timeout
+    # Wait for the upload responses, then fall back to visible thumbnails
     try:
-        dbg.wait("selector", f"{SELECTORS['thumbnail']} (timeout={thumb_timeout}s)")
-        await page.wait_for_selector(SELECTORS["thumbnail"], timeout=thumb_timeout * 1000)
-        dbg.info("[upload] thumbnails appeared")
-    except Exception:
-        dbg.wait("networkidle (fallback)")
-        await page.wait_for_load_state("networkidle")
-        await page.wait_for_timeout(2000)
-        dbg.info("[upload] continue after networkidle (fallback)")
+        dbg.wait("responses", f"{len(paths)} image uploads (timeout={thumb_timeout}s)")
+        await asyncio.wait_for(uploads_done, timeout=thumb_timeout)
+        dbg.info("[upload] all image uploads confirmed")
+    except asyncio.TimeoutError:
+        try:
+            dbg.wait("selector", f"{SELECTORS['thumbnail']} visible (fallback)")
+            await page.wait_for_selector(SELECTORS["thumbnail"], state="visible", timeout=THUMB_FALLBACK_MS)
+            dbg.info("[upload] thumbnails visible (fallback)")
+        except Exception:
+            dbg.info("[upload] continue without upload confirmation")
     dbg.duration("upload+wait", time.monotonic() - t0)
 
     # Retry title after upload if first attempt failed
@@ -335,27 +494,23 @@ async def upload_one_post(
         title_ok = await fill(page, SELECTORS["title_input"], title, dbg, timeout=8000)
 
     # Publish
-    delay_ms = int(random.uniform(pause_range[0], pause_range[1]) * 1000)
+    delay_ms = int(publish_pause * 1000)
     dbg.wait("pre-publish pause", f"{delay_ms}ms")
     await page.wait_for_timeout(delay_ms)
 
     if dry_run:
         dbg.info(f"[DRY-RUN] Would publish post '{title}' with {len(images)} images")
-        await page.close()
         return True
 
     t_pub = time.monotonic()
     ok_click = await click(page, SELECTORS["publish_button"], dbg, timeout=15_000)
     if not ok_click:
-        await page.close()
         return False
 
-    import re as _re
-    target_regex = _re.compile(r".*/posts/\d+(/edit)?")
     success = False
     try:
         dbg.wait("url", "posts/{id}")
-        await page.wait_for_url(target_regex, timeout=publish_timeout * 1000)
+        await page.wait_for_url(POST_URL_RE, timeout=publish_timeout * 1000)
         success = True
     except Exception:
         try:
@@ -369,7 +524,7 @@ async def upload_one_post(
         dbg.info(f"[post] no URL change after Publish in {publish_timeout}s, retrying once")
         if await click(page, SELECTORS["publish_button"], dbg, timeout=10_000):
             try:
-                await page.wait_for_url(target_regex, timeout=publish_timeout * 1000)
+                await page.wait_for_url(POST_URL_RE, timeout=publish_timeout * 1000)
                 success = True
             except Exception as e:
                 dbg.info(f"[post] second Publish attempt did not confirm: {repr(e)}")
@@ -378,13 +533,35 @@ async def upload_one_post(
 
     if not success:
         dbg.info(f"[post] Publish not confirmed for '{title}' within timeout")
-        await page.close()
         return False
 
     dbg.info(f"Published: {title}")
-    await page.close()
     return True
 
+async def save_storage_state(context: BrowserContext, dbg: DebugLogger) -> Optional[dict]:
+    # serializes the whole cookie/localStorage state, so only at checkpoints, never per post
+    try:
+        state = await context.storage_state()
+        write_state(state)
+        return state
+    except Exception as e:
+        dbg.info(f"[context] saving {STORAGE_STATE} failed: {repr(e)}")
+        return None
+
+async def recycle_context(browser, context: BrowserContext, trace_part: Optional[int], dbg: DebugLogger) -> BrowserContext:
+    # long-lived Chromium contexts leak; persist the session and start a fresh one
+    if trace_part is not None:
+        await context.tracing.stop(path=f"trace_{trace_part}.zip")
+        dbg.info(f"Trace saved to trace_{trace_part}.zip")
+    state = await save_storage_state(context, dbg)
+    await context.close()
+    # reuse the in-memory state rather than parsing the file we just wrote
+    context = await browser.new_context(storage_state=state if state is not None else read_state())
+    if trace_part is not None:
+        await context.tracing.start(screenshots=True, snapshots=True, sources=True)
+    dbg.info("[context] recycled browser context")
+    return context
+
 async def main_async():
     args = parse_args()
     lo, hi = [int(x) for x in args.pause.split("-")]
@@ -421,52 +598,179 @@ async def main_async():
             dbg.info(f"[discover] found {len(files)} files under {root}")
 
         conn = None
+        digests: Dict[Path, str] = {}
+        stats: Dict[Path, os.stat_result] = {}
+        seen: set = set()  # digests recorded in the DB or posted during this run
+        claimed: set = set()  # digests of queued/in-flight posts
         if not args.skip_hashes:
             conn = init_db(SQLITE_DB)
-            filtered = []
-            for f in files:
-                digest = sha256_file(f)
-                if not already_uploaded(conn, digest):
-                    filtered.append(f)
-            files = filtered
+            # startup is stat-only; content hashing happens per batch right before upload
+            recorded = known_stats(conn)
+            stats = {f: f.stat() for f in files}
+            files = [f for f in files if (str(f), stats[f].st_size, stats[f].st_mtime) not in recorded]
+            seen = known_digests(conn)
             if args.verbose or args.debug:
-                dbg.info(f"[dedupe] left {len(files)} files after SHA-256 filter")
-        if not files:
+                dbg.info(f"[dedupe] left {len(files)} new or modified files after stat filter")
+
+        workers = max(1, args.concurrency)
+        # pacing is drawn in post order by the producer; reproducible with --seed
+        rng = random.Random(args.seed)
+        # hashing runs a couple of posts ahead of the uploads (CPU/disk overlaps network)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+        produced = 0
+        ready = asyncio.Event()
+
+        async def emit(batch: List[Path]):
+            nonlocal produced
+            produced += 1
+            publish_pause = rng.uniform(pause_range[0], pause_range[1])
+            batch_pause = rng.uniform(pause_range[0], pause_range[1])
+            await queue.put((produced, batch, publish_pause, batch_pause))
+            ready.set()
+
+        async def produce():
+            # one hashing pool for the whole run; shutdown never blocks the event loop
+            pool = ThreadPoolExecutor(max_workers=HASH_WORKERS)
+            try:
+                await produce_posts(pool)
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+            await queue.put(None)
+            ready.set()
+
+        async def produce_posts(pool: ThreadPoolExecutor):
+            # dedupe a folder (or the flat stream) one post_size chunk at a time,
+            # then cut the survivors into full posts so skipped files don't leave gaps
+            for unit in group_units(files, args.group_by):
+                pending: List[Path] = []
+                for i in range(0, len(unit), args.post_size):
+                    chunk = unit[i:i + args.post_size]
+                    if conn:
+                        t_hash = time.monotonic()
+                        chunk_digests = await hash_files(chunk, pool)
+                        dbg.duration(f"hashing {len(chunk)} files", time.monotonic() - t_hash)
+                        known: List[Tuple[str, int, float, str]] = []
+                        for f, d in zip(chunk, chunk_digests):
+                            if d in seen:
+                                known.append((str(f), stats[f].st_size, stats[f].st_mtime, d))
+                            elif d in claimed:
+                                dbg.info(f"[dedupe] {f} duplicates a file in a pending post, held back until next run")
+                            else:
+                                claimed.add(d)
+                                digests[f] = d
+                                pending.append(f)
+                        with conn:
+                            record_stats(conn, known)
+                    else:
+                        pending.extend(chunk)
+                    while len(pending) >= args.post_size:
+                        await emit(pending[:args.post_size])
+                        pending = pending[args.post_size:]
+                if pending:
+                    await emit(pending)
+
+        producer = asyncio.create_task(produce())
+        # open the session only once there is at least one post to make
+        waiter = asyncio.create_task(ready.wait())
+        await asyncio.wait({producer, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if producer.done():
+            producer.result()
+        if not produced:
             print("No new images to upload. Either none found or all are already recorded.")
             await browser.close()
             return
 
+        state = None
         if os.path.exists(STORAGE_STATE):
-            context = await browser.new_context(storage_state=STORAGE_STATE)
-        else:
-            print("No storage_state.json found. Run with --login first.")
+            try:
+                state = read_state()
+            except ValueError:  # json/orjson decode errors
+                dbg.info(f"[context] {STORAGE_STATE} is not valid JSON")
+        if state is None:
+            print("No usable storage_state.json found. Run with --login first.")
+            producer.cancel()
             await browser.close()
             sys.exit(2)
+        context = await browser.new_context(storage_state=state)
 
         if args.trace:
             await context.tracing.start(screenshots=True, snapshots=True, sources=True)
 
-        batches = group_batches(files, args.group_by, args.post_size)
         success_total = 0
-        for idx, batch in enumerate(batches, start=1):
-            title = title_for_group(batch, args.title_from)
-            if args.verbose or args.debug:
-                dbg.info(f"[batch {idx}/{len(batches)}] {len(batch)} files -> '{title}'")
-            ok = await upload_one_post(context, batch, title, tags, pause_range, args.dry_run, args.verbose, args.publish_timeout, args.thumb_timeout, dbg)
-            if ok:
-                success_total += 1
-                if conn:
-                    for f in batch:
-                        mark_uploaded(conn, sha256_file(f), f)
-            await asyncio.sleep(random.uniform(pause_range[0], pause_range[1]))
+        attempted = 0
+        remaining = 0
+        finished = False
+
+        async def consume(context: BrowserContext):
+            nonlocal success_total, attempted, remaining, finished
+            while remaining > 0 and not finished:
+                remaining -= 1
+                item = await queue.get()
+                if item is None:
+                    finished = True
+                    queue.put_nowait(None)  # let sibling consumers see the end too
+                    return
+                idx, batch, publish_pause, batch_pause = item
+                title = title_for_group(batch, args.title_from)
+                if args.verbose or args.debug:
+                    dbg.info(f"[batch {idx}] {len(batch)} files -> '{title}'")
+                ok = await upload_one_post(context, batch, title, tags, publish_pause, args.dry_run, args.verbose, args.publish_timeout, args.thumb_timeout, dbg)
+                dbg.flush()  # a killed or hung run still leaves each finished post's log on disk
+                attempted += 1
+                batch_digests = {digests[f] for f in batch} if conn else set()
+                claimed.difference_update(batch_digests)
+                if ok:
+                    success_total += 1
+                    seen.update(batch_digests)
+                    # DB writes happen on the event loop thread only, so they never interleave
+                    if conn:
+                        with conn:
+                            mark_uploaded(conn, [(digests[f], str(f)) for f in batch])
+                            record_stats(conn, [(str(f), stats[f].st_size, stats[f].st_mtime, digests[f]) for f in batch])
+                # the producer keeps hashing upcoming posts while this slot sleeps
+                await asyncio.sleep(batch_pause)
+                # recycling already saves the session; without it, checkpoint every few posts
+                if args.context_recycle <= 0 and attempted % STATE_SAVE_EVERY == 0:
+                    await save_storage_state(context, dbg)
+
+        try:
+            # posts run in rounds of --context-recycle so the context is swapped only while idle
+            round_size = args.context_recycle if args.context_recycle > 0 else sys.maxsize
+            round_no = 0
+            while not finished:
+                if round_no:
+                    context = await recycle_context(browser, context, round_no if args.trace else None, dbg)
+                round_no += 1
+                remaining = round_size
+                consumers = [asyncio.create_task(consume(context)) for _ in range(workers)]
+                try:
+                    # also watch the producer so a hashing error doesn't leave consumers blocked on the queue
+                    pending = set(consumers)
+                    while pending:
+                        watch = pending if producer.done() else pending | {producer}
+                        done, _ = await asyncio.wait(watch, return_when=asyncio.FIRST_COMPLETED)
+                        for t in done:
+                            t.result()
+                        pending -= done
+                finally:
+                    for t in consumers:
+                        t.cancel()
+                if producer.done() and queue.qsize() <= 1:
+                    finished = True  # only the end marker is left; no need to recycle again
+        finally:
+            producer.cancel()
 
         if args.trace:
             await context.tracing.stop(path="trace.zip")
             dbg.info("Trace saved to trace.zip")
 
-        await context.storage_state(path=STORAGE_STATE)
+        await save_storage_state(context, dbg)
         await browser.close()
-        print(f"Done. Posts created: {success_total}/{len(batches)}")
+        if conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+        print(f"Done. Posts created: {success_total}/{attempted}")
 
 if __name__ == "__main__":
     try: